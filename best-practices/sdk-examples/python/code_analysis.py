@@ -5,6 +5,7 @@ Demonstrates using Claude for code review and improvement suggestions
 """
 import os
 from anthropic import Anthropic
+import tokens
 
 def analyze_code(client, code_snippet, language="python"):
     """Analyze code and provide improvement suggestions"""
@@ -21,9 +22,12 @@ Code:
 ```
 """
     
-    message = client.messages.create(
+    # max_tokens is sized from the prompt and earlier responses, and a
+    # response cut off at that limit is retried once with a larger one
+    message = tokens.create_sized_message(
+        client,
+        "code_analysis",
         model="claude-3-5-sonnet-20241022",
-        max_tokens=2048,
         system="You are an expert code reviewer. Provide constructive feedback.",
         messages=[
             {"role": "user", "content": prompt}
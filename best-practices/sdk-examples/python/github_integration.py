@@ -7,6 +7,26 @@ import os
 import subprocess
 import json
 from anthropic import Anthropic
+import tokens
+import tracing
+from tracing import span
+
+# Diffs beyond this many tokens are cut at a line boundary
+PR_DIFF_TOKEN_BUDGET = 20_000
+# Token calibration is shared with the MCP assistant's database
+STATS_DB_PATH = "~/.config/claude/databases/assistant.db"
+
+def gh_api(*args):
+    """Run a `gh api` call and decode its JSON output"""
+    with span("gh api", endpoint=args[0]):
+        result = subprocess.run(
+            ["gh", "api", *args],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+    with span("json.loads", endpoint=args[0]):
+        return json.loads(result.stdout)
 
 def get_github_info(repo_url):
     """Extract owner and repo name from GitHub URL"""
@@ -22,7 +42,8 @@ def get_github_info(repo_url):
         return parts[0], parts[1]
     return None, None
 
-def analyze_repository(client, repo_url):
+@tracing.traced()
+def analyze_repository(client, repo_url, estimator=None):
     """Use Claude to analyze a GitHub repository"""
     owner, repo = get_github_info(repo_url)
     if not owner or not repo:
@@ -32,31 +53,13 @@ def analyze_repository(client, repo_url):
     # Use gh CLI to get repository information
     try:
         # Get repository details
-        repo_info = subprocess.run(
-            ["gh", "api", f"repos/{owner}/{repo}"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        repo_data = json.loads(repo_info.stdout)
+        repo_data = gh_api(f"repos/{owner}/{repo}")
         
         # Get recent commits
-        commits = subprocess.run(
-            ["gh", "api", f"repos/{owner}/{repo}/commits", "--paginate", "-X", "GET", "-F", "per_page=10"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        commits_data = json.loads(commits.stdout)
+        commits_data = gh_api(f"repos/{owner}/{repo}/commits", "--paginate", "-X", "GET", "-F", "per_page=10")
         
         # Get languages
-        languages = subprocess.run(
-            ["gh", "api", f"repos/{owner}/{repo}/languages"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        languages_data = json.loads(languages.stdout)
+        languages_data = gh_api(f"repos/{owner}/{repo}/languages")
         
     except subprocess.CalledProcessError as e:
         print(f"Error fetching repository data: {e}")
@@ -77,7 +80,8 @@ Recent Commits:
 """
     
     for i, commit in enumerate(commits_data[:5], 1):
-        context += f"{i}. {commit['commit']['message'].split('\\n')[0]} by {commit['commit']['author']['name']}\n"
+        subject = commit['commit']['message'].split('\n')[0]
+        context += f"{i}. {subject} by {commit['commit']['author']['name']}\n"
     
     # Ask Claude to analyze the repository
     prompt = f"""Based on this GitHub repository information, please provide:
@@ -95,25 +99,35 @@ Repository Information:
     print(f"Analyzing {repo_data['full_name']}...")
     print("=" * 60)
     
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=2048,
-        system="You are a software engineering expert who analyzes GitHub repositories to provide insights and recommendations.",
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
+    with span("messages.create", model="claude-3-5-sonnet-20241022"):
+        message = tokens.create_sized_message(
+            client,
+            "repo_analysis",
+            estimator,
+            model="claude-3-5-sonnet-20241022",
+            system="You are a software engineering expert who analyzes GitHub repositories to provide insights and recommendations.",
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
     
     return message.content[0].text
 
-def create_pr_description(client, diff_content, branch_name):
+@tracing.traced()
+def create_pr_description(client, diff_content, branch_name, estimator=None):
     """Generate a PR description from git diff"""
+    estimator = estimator or tokens.default_estimator
+    chunks = estimator.split(diff_content, PR_DIFF_TOKEN_BUDGET, "claude-3-5-sonnet-20241022")
+    diff = chunks[0] if chunks else ""
+    if len(chunks) > 1:
+        diff += f"\n... ({len(chunks) - 1} more part(s) of the diff omitted)\n"
+    
     prompt = f"""Based on this git diff, create a comprehensive pull request description.
 
 Branch: {branch_name}
 Diff:
 ```
-{diff_content[:3000]}  # Truncate if too long
+{diff}
 ```
 
 Please provide:
@@ -125,20 +139,26 @@ Please provide:
 6. Any breaking changes or migration notes
 """
     
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=1024,
-        temperature=0.3,
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
+    with span("messages.create", model="claude-3-5-sonnet-20241022"):
+        message = tokens.create_sized_message(
+            client,
+            "pr_description",
+            estimator,
+            model="claude-3-5-sonnet-20241022",
+            temperature=0.3,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
     
     return message.content[0].text
 
 def main():
     # Initialize Claude client
     client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+    db_path = os.path.expanduser(STATS_DB_PATH)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    estimator = tokens.TokenEstimator(db_path)
     
     # Example 1: Analyze a repository
     print("Example 1: Repository Analysis")
@@ -146,7 +166,7 @@ def main():
     
     # You can analyze any public repository
     repo_url = "https://github.com/anthropics/anthropic-sdk-python"
-    analysis = analyze_repository(client, repo_url)
+    analysis = analyze_repository(client, repo_url, estimator)
     if analysis:
         print(analysis)
     
@@ -172,10 +192,12 @@ index abc123..def456 100644
 +        return base ** exponent
 """
     
-    pr_description = create_pr_description(client, sample_diff, "feature/add-math-operations")
+    pr_description = create_pr_description(client, sample_diff, "feature/add-math-operations", estimator)
     print(pr_description)
 
 if __name__ == "__main__":
+    args = tracing.parse_args(description="GitHub integration examples")
+    
     # Ensure GitHub CLI is authenticated
     try:
         subprocess.run(["gh", "auth", "status"], check=True, capture_output=True)
@@ -183,4 +205,5 @@ if __name__ == "__main__":
         print("Error: GitHub CLI is not authenticated. Run 'gh auth login' first.")
         exit(1)
     
-    main()
\ No newline at end of file
+    with tracing.profile(args.profile, args.profile_output):
+        main()
\ No newline at end of file
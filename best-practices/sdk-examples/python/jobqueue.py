@@ -0,0 +1,323 @@
+"""
+Durable Review Job Queue
+A SQLite-backed job table living next to interactions/code_reviews.
+Jobs move pending -> leased -> done (or failed once their retries run
+out); worker processes claim them atomically, and a leased job whose
+worker died becomes claimable again when its lease expires.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 5
+
+
+def new_run_id():
+    """Short unique identifier for a bulk run"""
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+def worker_name():
+    """Identify this process as a lease owner"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner):
+    """Whether a worker_name() owner may still be running
+
+    Only processes on this host can be checked; owners on other hosts
+    are assumed alive.
+    """
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PermanentJobError(Exception):
+    """Raised by a job that retrying cannot fix"""
+
+
+class LeaseKeeper:
+    """Renews a job's lease in the background while the job runs
+
+    Without renewal, a job that outlives its lease (e.g. a large file
+    reviewed in several parts) would be claimed and run again by
+    another worker.
+    """
+
+    def __init__(self, queue, job_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.queue = queue
+        self.job_id = job_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                renewed = self.queue.extend(self.job_id, self.owner, self.lease_seconds)
+            except sqlite3.OperationalError:
+                # Database busy; a third of the lease is left, so try again next tick
+                continue
+            if not renewed:
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class JobQueue:
+    def __init__(self, db_path):
+        self.db_path = os.path.expanduser(db_path)
+        self.init_database()
+
+    def connect(self):
+        """Autocommit connection; write transactions are opened explicitly"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_database(self):
+        """Create the review_jobs table and switch the database to WAL mode"""
+        conn = self.connect()
+        # WAL lets readers and the single writer proceed concurrently
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS review_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                target TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                not_before REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (run_id, kind, target)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_review_jobs_claim
+            ON review_jobs (run_id, state, not_before)
+        ''')
+        conn.close()
+
+    def enqueue(self, run_id, jobs, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Add (kind, target) jobs to a run; duplicates are ignored"""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO review_jobs (run_id, kind, target, max_attempts)
+                VALUES (?, ?, ?, ?)
+            ''', [(run_id, kind, target, max_attempts) for kind, target in jobs])
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+            return added
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, run_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Atomically lease the next runnable job, or return None"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers
+            # can never select and lease the same row
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                UPDATE review_jobs
+                SET state = 'failed', lease_owner = NULL, lease_expires = NULL,
+                    last_error = COALESCE(last_error, 'lease expired'),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE run_id = ? AND state = 'leased' AND lease_expires < ?
+                  AND attempts >= max_attempts
+            ''', (run_id, now))
+            row = conn.execute('''
+                SELECT id, kind, target, attempts FROM review_jobs
+                WHERE run_id = ? AND not_before <= ?
+                  AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?))
+                ORDER BY id
+                LIMIT 1
+            ''', (run_id, now, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute('''
+                UPDATE review_jobs
+                SET state = 'leased', lease_owner = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (owner, now + lease_seconds, row["id"]))
+            conn.execute("COMMIT")
+            return {"id": row["id"], "kind": row["kind"], "target": row["target"],
+                    "attempt": row["attempts"] + 1}
+        except BaseException:
+            # BEGIN IMMEDIATE itself may have failed (e.g. database is
+            # locked); only roll back a transaction that actually started
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id, owner):
+        """Mark a leased job done; returns False if the lease was lost"""
+        return self._update_leased(job_id, owner, '''
+            UPDATE review_jobs
+            SET state = 'done', lease_owner = NULL, lease_expires = NULL,
+                last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+        ''')
+
+    def fail(self, job_id, owner, error, permanent=False):
+        """Record a failed attempt: retry later with backoff, or give up
+
+        A permanent failure gives up at once, whatever attempts are left.
+        """
+        return self._update_leased(job_id, owner, '''
+            UPDATE review_jobs
+            SET state = CASE WHEN ? OR attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                not_before = ? + ? * (1 << (attempts - 1)),
+                lease_owner = NULL, lease_expires = NULL,
+                last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+        ''', (permanent, time.time(), RETRY_BACKOFF_SECONDS, str(error)[:1000]))
+
+    def extend(self, job_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Push a held lease's expiry forward; returns False if it was lost"""
+        return self._update_leased(job_id, owner, '''
+            UPDATE review_jobs
+            SET lease_expires = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+        ''', (time.time() + lease_seconds,))
+
+    def release(self, job_id, owner):
+        """Hand an interrupted job back without counting the attempt"""
+        return self._update_leased(job_id, owner, '''
+            UPDATE review_jobs
+            SET state = 'pending', attempts = attempts - 1,
+                lease_owner = NULL, lease_expires = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+        ''')
+
+    def _update_leased(self, job_id, owner, sql, params=()):
+        conn = self.connect()
+        cursor = conn.execute(sql, params + (job_id, owner))
+        conn.close()
+        return cursor.rowcount == 1
+
+    def requeue_leased(self, run_id):
+        """Return leased jobs of a stopped run to pending
+
+        Only leases whose owner process is gone (or whose lease expired)
+        are reclaimed, so resuming while workers of the run are still
+        alive doesn't run their jobs twice.
+        """
+        conn = self.connect()
+        try:
+            leases = conn.execute('''
+                SELECT id, lease_owner, lease_expires FROM review_jobs
+                WHERE run_id = ? AND state = 'leased'
+            ''', (run_id,)).fetchall()
+            now = time.time()
+            requeued = 0
+            for row in leases:
+                if row["lease_expires"] >= now and owner_alive(row["lease_owner"]):
+                    continue
+                cursor = conn.execute('''
+                    UPDATE review_jobs
+                    SET state = 'pending', attempts = MAX(attempts - 1, 0),
+                        lease_owner = NULL, lease_expires = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND lease_owner = ? AND state = 'leased'
+                ''', (row["id"], row["lease_owner"]))
+                requeued += cursor.rowcount
+            return requeued
+        finally:
+            conn.close()
+
+    def has_unfinished(self, run_id):
+        """True while any job of the run is pending or leased"""
+        conn = self.connect()
+        row = conn.execute('''
+            SELECT 1 FROM review_jobs
+            WHERE run_id = ? AND state IN ('pending', 'leased')
+            LIMIT 1
+        ''', (run_id,)).fetchone()
+        conn.close()
+        return row is not None
+
+    def stats(self, run_id):
+        """Job counts per state for a run"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT state, COUNT(*) FROM review_jobs
+            WHERE run_id = ?
+            GROUP BY state
+        ''', (run_id,)).fetchall()
+        conn.close()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update({state: count for state, count in rows})
+        return counts
+
+    def runs(self, limit=10):
+        """Most recent runs with their job counts"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT run_id, MIN(created_at), COUNT(*),
+                   SUM(state = 'done'), SUM(state = 'failed')
+            FROM review_jobs
+            GROUP BY run_id
+            ORDER BY MIN(id) DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.close()
+        return [tuple(row) for row in rows]
+
+    def failures(self, run_id):
+        """(target, last_error) for every failed job of a run"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT target, last_error FROM review_jobs
+            WHERE run_id = ? AND state = 'failed'
+            ORDER BY id
+        ''', (run_id,)).fetchall()
+        conn.close()
+        return [tuple(row) for row in rows]
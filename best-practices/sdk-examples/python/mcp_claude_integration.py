@@ -3,17 +3,59 @@
 MCP + Claude SDK Integration Example
 Shows how to combine MCP services with Claude's capabilities
 """
+import argparse
+import multiprocessing
 import os
 import sqlite3
 import json
+import time
 from datetime import datetime
 from anthropic import Anthropic
+import jobqueue
+import packing
+import tokens
+import tracing
+from github_integration import analyze_repository
+from jobqueue import JobQueue
+from scheduler import SharedLaneScheduler
+from singleflight import CoalescingClient, SingleFlight, request_key
+from tracing import span
+
+DEFAULT_DB_PATH = "~/.config/claude/databases/assistant.db"
+MODEL = "claude-sonnet-4-20250514"
+REVIEW_SYSTEM_PROMPT = "You are an expert code reviewer. Provide constructive, actionable feedback."
+# Scheduler lane per task; anything not listed runs as bulk
+TASK_LANES = {
+    "query": "interactive",
+    "file_review": "bulk",
+    "packed_review": "bulk",
+    "repo_analysis": "bulk",
+    "daily_summary": "background",
+}
+
+# Job errors that retrying cannot fix; such jobs fail without further attempts
+PERMANENT_JOB_ERRORS = (
+    FileNotFoundError,
+    IsADirectoryError,
+    PermissionError,
+    UnicodeDecodeError,
+    tokens.PromptTooLargeError,
+    jobqueue.PermanentJobError,
+)
+
+# Shared by every assistant in the process so identical concurrent
+# requests (e.g. from worker threads) reach the API only once
+_inflight = SingleFlight()
 
 class IntelligentMCPAssistant:
-    def __init__(self, db_path="~/.config/claude/databases/assistant.db"):
+    def __init__(self, db_path=DEFAULT_DB_PATH):
         self.client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
         self.db_path = os.path.expanduser(db_path)
         self.init_database()
+        self.estimator = tokens.TokenEstimator(self.db_path)
+        # Lanes are shared through the database, so bulk worker processes
+        # and interactive calls from other processes compete for one quota
+        self.scheduler = SharedLaneScheduler(self.db_path)
     
     def init_database(self):
         """Initialize SQLite database for storing interactions"""
@@ -48,39 +90,182 @@ class IntelligentMCPAssistant:
     def analyze_file_with_context(self, file_path):
         """Read file using MCP filesystem and analyze with Claude"""
         try:
+            return self.review_file(file_path)
+        except Exception as e:
+            return f"Error analyzing file: {str(e)}"
+    
+    @tracing.traced()
+    def review_file(self, file_path):
+        """Review one file and store the result; errors propagate to the caller"""
+        with span("read_file", path=file_path):
             with open(file_path, 'r') as f:
                 content = f.read()
-            
-            prompt = f"""Analyze this code file and provide:
+        
+        # Files too large for one request are reviewed in parts
+        budget = int(self.estimator.input_budget(MODEL, "file_review") * 0.9)
+        if self.estimator.estimate(content, MODEL) > budget:
+            parts = self.estimator.split(content, budget, MODEL)
+        else:
+            parts = [content]
+        
+        reviews = []
+        for i, part in enumerate(parts, 1):
+            label = file_path if len(parts) == 1 else f"{file_path} (part {i} of {len(parts)})"
+            with span("format_prompt"):
+                prompt = f"""Analyze this code file and provide:
 1. Summary of functionality
 2. Code quality assessment (1-10)
 3. Potential issues or bugs
 4. Improvement suggestions
 5. Security considerations
 
-File: {file_path}
+File: {label}
 Content:
 ```
-{content}
+{part}
 ```
 """
             
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=2048,
-                system="You are an expert code reviewer. Provide constructive, actionable feedback.",
+            message = self.create_message(
+                "file_review",
+                model=MODEL,
+                system=REVIEW_SYSTEM_PROMPT,
                 messages=[{"role": "user", "content": prompt}]
             )
-            
-            response = message.content[0].text
-            
-            # Store in database
+            reviews.append(message.content[0].text)
+        
+        response = "\n\n".join(reviews)
+        
+        # Store in database
+        with span("store_code_review"):
             self.store_code_review(file_path, response)
+        
+        return response
+    
+    @tracing.traced()
+    def plan_directory(self, root, max_bytes=packing.DEFAULT_MAX_BYTES,
+                       token_budget=packing.PACK_TOKEN_BUDGET):
+        """Return (large file paths, batches of small (path, content) files)
+        for every source file under root"""
+        large_files = []
+        small_files = []
+        
+        with span("walk_source_files", root=root):
+            paths = list(packing.walk_source_files(root, max_bytes))
+        
+        for path in paths:
+            try:
+                with open(path, 'r') as f:
+                    content = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
             
-            return response
-            
-        except Exception as e:
-            return f"Error analyzing file: {str(e)}"
+            if self.file_tokens(content) <= packing.SMALL_FILE_TOKENS:
+                small_files.append((path, content))
+            else:
+                large_files.append(path)
+        
+        # Limit batch size by expected output too, so the combined review
+        # fits the max_tokens a non-streaming request may ask for. Sized by
+        # the batch's mean file size, as plan() sizes its max_tokens
+        batches = packing.pack_files(
+            small_files, token_budget,
+            max_files=lambda per_file: self.estimator.max_units("packed_review", per_file),
+            estimate=self.file_tokens)
+        return large_files, batches
+    
+    def file_tokens(self, content):
+        """Estimated tokens of one file's content, as used for packing"""
+        return self.estimator.estimate(content, MODEL)
+    
+    @tracing.traced()
+    def analyze_directory(self, root, max_bytes=packing.DEFAULT_MAX_BYTES,
+                          token_budget=packing.PACK_TOKEN_BUDGET):
+        """Review every source file under root, packing small files together"""
+        results = {}
+        large_files, batches = self.plan_directory(root, max_bytes, token_budget)
+        
+        for path in large_files:
+            results[path] = self.analyze_file_with_context(path)
+        for batch in batches:
+            results.update(self.analyze_batch(batch))
+        
+        return results
+    
+    def analyze_batch(self, batch):
+        """Review a batch from plan_directory; a batch of one is a plain file review"""
+        if len(batch) == 1:
+            path = batch[0][0]
+            return {path: self.analyze_file_with_context(path)}
+        return self.analyze_packed_files(batch)
+    
+    @tracing.traced()
+    def analyze_packed_files(self, batch):
+        """Review several small files in one request, one code_reviews row each"""
+        paths = [path for path, _ in batch]
+        with span("format_prompt", files=len(batch)):
+            prompt = packing.build_packed_prompt(batch)
+        
+        # API errors propagate: retrying each file separately would only
+        # multiply traffic during an outage or rate-limit storm
+        message = self.create_message(
+            "packed_review",
+            units=len(batch),
+            unit_tokens=sum(self.file_tokens(content) for _, content in batch) // len(batch),
+            model=MODEL,
+            system=REVIEW_SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        reviews = packing.split_packed_response(message.content[0].text, paths)
+        
+        if reviews is None:
+            # The response couldn't be attributed to files; review them one by one
+            print(f"Packed review of {len(batch)} files could not be split; "
+                  f"reviewing them individually")
+            with span("packed_fallback", files=len(batch)):
+                return {path: self.analyze_file_with_context(path) for path in paths}
+        
+        with span("store_code_review", files=len(batch)):
+            for path in paths:
+                self.store_code_review(path, reviews[path])
+        return reviews
+    
+    def client_for(self, task, lane=None):
+        """Client whose calls use the task's lane and are coalesced, for
+        helpers (like the GitHub examples) that take a client"""
+        scheduled = self.scheduler.client(self.client, lane or TASK_LANES.get(task, "bulk"))
+        return CoalescingClient(scheduled, _inflight)
+    
+    def create_message(self, task, units=1, lane=None, unit_tokens=None, **request):
+        """Send a sized Messages API request through the task's scheduler
+        lane, sharing identical in-flight calls"""
+        client = self.scheduler.client(self.client, lane or TASK_LANES.get(task, "bulk"))
+        with span("messages.create", model=request["model"], task=task) as s:
+            message = _inflight.do(
+                request_key(dict(request, task=task, units=units)),
+                lambda: tokens.create_sized_message(
+                    client, task, self.estimator, units, unit_tokens, **request)
+            )
+            s.set(input_tokens=message.usage.input_tokens,
+                  output_tokens=message.usage.output_tokens)
+        return message
+    
+    def stream_message(self, task, lane=None, **request):
+        """Stream response text, fanning one API stream out to identical callers"""
+        client = self.scheduler.client(self.client, lane or TASK_LANES.get(task, "bulk"))
+        
+        def open_stream():
+            plan = self.estimator.plan(request, task, streaming=True)
+            sized = dict(request, model=plan.model, max_tokens=plan.max_tokens)
+            with client.messages.stream(**sized) as stream:
+                yield from stream.text_stream
+                final = stream.get_final_message()
+                self.estimator.record(sized, plan, final.usage, task,
+                                      truncated=final.stop_reason == "max_tokens")
+        
+        key = request_key(dict(request, task=task, stream=True))
+        with span("messages.stream", model=request["model"]):
+            yield from _inflight.stream(key, open_stream)
     
     def store_code_review(self, file_path, analysis):
         """Store code review results in SQLite"""
@@ -97,6 +282,7 @@ Content:
         conn.commit()
         conn.close()
     
+    @tracing.traced()
     def get_historical_insights(self, query):
         """Use past interactions to provide better responses"""
         conn = sqlite3.connect(self.db_path)
@@ -120,8 +306,8 @@ Content:
         
         return context if history else ""
     
-    def intelligent_query(self, query, use_history=True):
-        """Process a query with optional historical context"""
+    def build_query_prompt(self, query, use_history=True):
+        """Return (prompt, context) for a query with optional history"""
         context = ""
         if use_history:
             context = self.get_historical_insights(query)
@@ -129,27 +315,53 @@ Content:
         prompt = query
         if context:
             prompt = f"Context from previous interactions:\n{context}\n\nCurrent query: {query}"
+        return prompt, context
+    
+    @tracing.traced()
+    def intelligent_query(self, query, use_history=True):
+        """Process a query with optional historical context"""
+        prompt, context = self.build_query_prompt(query, use_history)
         
-        message = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
+        message = self.create_message(
+            "query",
+            model=MODEL,
             messages=[{"role": "user", "content": prompt}]
         )
         
         response = message.content[0].text
         
-        # Store interaction
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO interactions (query, response, context, tokens_used)
-            VALUES (?, ?, ?, ?)
-        ''', (query, response, context, len(prompt.split()) + len(response.split())))
-        conn.commit()
-        conn.close()
+        self.store_interaction(query, response, context, prompt)
         
         return response
     
+    def stream_query(self, query, use_history=True):
+        """Like intelligent_query, but yields the response text as it arrives"""
+        prompt, context = self.build_query_prompt(query, use_history)
+        
+        chunks = []
+        for text in self.stream_message(
+            "query",
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}]
+        ):
+            chunks.append(text)
+            yield text
+        
+        self.store_interaction(query, "".join(chunks), context, prompt)
+    
+    def store_interaction(self, query, response, context, prompt):
+        """Store a query/response pair in SQLite"""
+        with span("store_interaction"):
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO interactions (query, response, context, tokens_used)
+                VALUES (?, ?, ?, ?)
+            ''', (query, response, context, len(prompt.split()) + len(response.split())))
+            conn.commit()
+            conn.close()
+    
+    @tracing.traced()
     def generate_daily_summary(self):
         """Generate a summary of today's activities"""
         conn = sqlite3.connect(self.db_path)
@@ -200,17 +412,214 @@ Data:
 {summary_data}
 """
         
-        message = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=512,
+        message = self.create_message(
+            "daily_summary",
+            model=MODEL,
             temperature=0.7,
             messages=[{"role": "user", "content": prompt}]
         )
         
         return message.content[0].text
 
+def expand_targets(assistant, targets):
+    """Turn CLI targets into (kind, target) jobs
+    
+    Directories are packed up front: large files become "file" jobs and
+    each batch of small files one "batch" job, whose target is the JSON
+    list of its paths.
+    """
+    jobs = []
+    for target in targets:
+        if target.startswith(("https://github.com/", "git@github.com:")):
+            jobs.append(("repo", target))
+        elif os.path.isdir(target):
+            large_files, batches = assistant.plan_directory(os.path.abspath(target))
+            jobs.extend(("file", path) for path in large_files)
+            for batch in batches:
+                if len(batch) == 1:
+                    jobs.append(("file", batch[0][0]))
+                else:
+                    jobs.append(("batch", json.dumps([path for path, _ in batch])))
+        else:
+            jobs.append(("file", os.path.abspath(target)))
+    return jobs
+
+def read_batch(target):
+    """(path, content) pairs of a "batch" job, read when the job runs"""
+    batch = []
+    for path in json.loads(target):
+        with open(path, 'r') as f:
+            batch.append((path, f.read()))
+    return batch
+
+def describe_target(target):
+    """Short label for a job target; batch targets are JSON path lists"""
+    if target.startswith("["):
+        paths = json.loads(target)
+        return f"{len(paths)} files in {os.path.commonpath(paths)}"
+    return target
+
+def run_job(assistant, job):
+    """Execute one queued job, raising on failure so it can be retried"""
+    if job["kind"] == "file":
+        assistant.review_file(job["target"])
+    elif job["kind"] == "batch":
+        assistant.analyze_batch(read_batch(job["target"]))
+    elif job["kind"] == "repo":
+        analysis = analyze_repository(
+            assistant.client_for("repo_analysis"), job["target"], assistant.estimator)
+        if analysis is None:
+            raise RuntimeError(f"Could not fetch repository data for {job['target']}")
+        assistant.store_code_review(job["target"], analysis)
+    else:
+        raise jobqueue.PermanentJobError(f"Unknown job kind: {job['kind']}")
+
+def retry_locked(action, fn, *args):
+    """Call fn(*args), retrying while the database is locked
+
+    The jobs, scheduler and token-stats tables share one SQLite file, so
+    any write can briefly hit "database is locked" under load.
+    """
+    while True:
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            print(f"  {action} failed, retrying: {e}")
+            time.sleep(1)
+
+def work(db_path, run_id, lease_seconds=jobqueue.DEFAULT_LEASE_SECONDS):
+    """Claim and run jobs until the run has nothing left to do"""
+    queue = JobQueue(db_path)
+    assistant = IntelligentMCPAssistant(db_path)
+    owner = jobqueue.worker_name()
+    
+    while True:
+        job = retry_locked("claim", queue.claim, run_id, owner, lease_seconds)
+        if job is None:
+            if not queue.has_unfinished(run_id):
+                return
+            # Remaining jobs are backing off or leased by other workers
+            time.sleep(1)
+            continue
+        
+        label = describe_target(job["target"])
+        try:
+            with jobqueue.LeaseKeeper(queue, job["id"], owner, lease_seconds):
+                with span("job", kind=job["kind"], target=job["target"], attempt=job["attempt"]):
+                    run_job(assistant, job)
+        except KeyboardInterrupt:
+            retry_locked("release", queue.release, job["id"], owner)
+            raise
+        except Exception as e:
+            permanent = isinstance(e, PERMANENT_JOB_ERRORS)
+            retry_locked("fail", queue.fail, job["id"], owner, e, permanent)
+            attempt = "permanently" if permanent else f"({job['attempt']})"
+            print(f"  failed {attempt}: {label}: {e}")
+        else:
+            if retry_locked("complete", queue.complete, job["id"], owner):
+                print(f"  done: {label}")
+            else:
+                print(f"  lease lost, result may be duplicated: {label}")
+
+def _worker_process(db_path, run_id, trace_path, worker):
+    # Each worker writes its own trace file. The path is passed in rather
+    # than inherited, so this also works with the spawn start method
+    if trace_path:
+        tracing.enable(tracing.worker_trace_path(trace_path, f"worker{worker}"))
+    try:
+        work(db_path, run_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tracing.flush()
+
+def run_workers(db_path, run_id, workers):
+    """Process a run with `workers` processes, each claiming jobs from SQLite"""
+    try:
+        if workers <= 1:
+            work(db_path, run_id)
+        else:
+            processes = [
+                multiprocessing.Process(
+                    target=_worker_process,
+                    args=(db_path, run_id, tracing.trace_path(), worker)
+                )
+                for worker in range(1, workers + 1)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Continue with: resume {run_id}")
+        return
+    print_run_status(JobQueue(db_path), run_id)
+
+def print_run_status(queue, run_id):
+    counts = queue.stats(run_id)
+    print(f"Run {run_id}: " + ", ".join(f"{state} {count}" for state, count in counts.items()))
+    for target, error in queue.failures(run_id):
+        print(f"  failed: {describe_target(target)}: {error}")
+
 def main():
-    assistant = IntelligentMCPAssistant()
+    parser = argparse.ArgumentParser(description="MCP + Claude integration examples")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    tracing.add_arguments(parser)
+    commands = parser.add_subparsers(dest="command")
+    
+    review = commands.add_parser("review", help="queue and review files, directories or GitHub repositories")
+    review.add_argument("targets", nargs="+")
+    review.add_argument("--workers", type=int, default=4)
+    review.add_argument("--max-attempts", type=int, default=jobqueue.DEFAULT_MAX_ATTEMPTS)
+    
+    resume = commands.add_parser("resume", help="continue a stopped review run")
+    resume.add_argument("run_id")
+    resume.add_argument("--workers", type=int, default=4)
+    
+    query = commands.add_parser("query", help="ask an interactive question (served ahead of bulk runs)")
+    query.add_argument("text")
+    query.add_argument("--no-history", action="store_true")
+    
+    status = commands.add_parser("status", help="show job counts for a run (or list recent runs)")
+    status.add_argument("run_id", nargs="?")
+    
+    args = parser.parse_args()
+    tracing.configure(args)
+    db_path = os.path.expanduser(args.db)
+    
+    with tracing.profile(args.profile, args.profile_output):
+        if args.command == "review":
+            queue = JobQueue(db_path)
+            run_id = jobqueue.new_run_id()
+            jobs = expand_targets(IntelligentMCPAssistant(db_path), args.targets)
+            added = queue.enqueue(run_id, jobs, args.max_attempts)
+            print(f"Run {run_id}: queued {added} jobs")
+            run_workers(db_path, run_id, args.workers)
+        elif args.command == "resume":
+            queue = JobQueue(db_path)
+            # Leases left behind by dead workers are reclaimed at once;
+            # live workers of the run keep theirs
+            requeued = queue.requeue_leased(args.run_id)
+            if requeued:
+                print(f"Run {args.run_id}: requeued {requeued} jobs of stopped workers")
+            run_workers(db_path, args.run_id, args.workers)
+        elif args.command == "query":
+            assistant = IntelligentMCPAssistant(db_path)
+            for text in assistant.stream_query(args.text, use_history=not args.no_history):
+                print(text, end='', flush=True)
+            print()
+        elif args.command == "status":
+            queue = JobQueue(db_path)
+            if args.run_id:
+                print_run_status(queue, args.run_id)
+            else:
+                for run_id, created, total, done, failed in queue.runs():
+                    print(f"{run_id}  {created}  {done}/{total} done, {failed} failed")
+        else:
+            run_examples(db_path)
+
+def run_examples(db_path=DEFAULT_DB_PATH):
+    assistant = IntelligentMCPAssistant(db_path)
     
     print("MCP + Claude Integration Examples")
     print("=" * 60)
@@ -222,16 +631,24 @@ def main():
     analysis = assistant.analyze_file_with_context(__file__)
     print(analysis[:500] + "..." if len(analysis) > 500 else analysis)
     
-    # Example 2: Intelligent query with history
-    print("\n\n2. Intelligent Query:")
+    # Example 2: Review a directory, packing small files into shared requests
+    print("\n\n2. Analyzing a directory:")
+    print("-" * 40)
+    reviews = assistant.analyze_directory(os.path.dirname(os.path.abspath(__file__)))
+    for path, review in reviews.items():
+        first_line = review.strip().splitlines()[0] if review.strip() else ""
+        print(f"{os.path.basename(path)}: {first_line[:100]}")
+    
+    # Example 3: Intelligent query with history
+    print("\n\n3. Intelligent Query:")
     print("-" * 40)
     response = assistant.intelligent_query(
         "What are best practices for Python error handling?"
     )
     print(response)
     
-    # Example 3: Generate summary
-    print("\n\n3. Daily Summary:")
+    # Example 4: Generate summary
+    print("\n\n4. Daily Summary:")
     print("-" * 40)
     summary = assistant.generate_daily_summary()
     print(summary)
@@ -245,6 +662,10 @@ def main():
     
     print(f"\n\nTotal interactions stored: {count}")
     print(f"Database location: {assistant.db_path}")
+    
+    print("\nScheduler lanes:")
+    for lane, stats in assistant.scheduler.metrics().items():
+        print(f"  {lane}: {stats}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Small-File Packing
+Walks a source tree and bin-packs small files into shared review
+requests, so tiny configs and __init__.py files don't each pay the full
+per-request overhead and system prompt.
+"""
+import fnmatch
+import os
+import re
+import subprocess
+from tokens import raw_estimate
+
+# Files larger than this are never sent for review
+DEFAULT_MAX_BYTES = 100_000
+# Files estimated under this many tokens are candidates for packing
+SMALL_FILE_TOKENS = 1500
+# Input token budget for the file contents of one packed request
+PACK_TOKEN_BUDGET = 12_000
+
+_SECTION_RE = re.compile(r"^### FILE: (.+?)\s*$", re.MULTILINE)
+
+
+def is_binary(path, sniff_bytes=8192):
+    """Treat a file as binary if its first block contains a NUL byte"""
+    try:
+        with open(path, 'rb') as f:
+            return b"\0" in f.read(sniff_bytes)
+    except OSError:
+        return True
+
+
+def _git_listed_files(root):
+    """Tracked and untracked-but-not-ignored files, or None outside a git repo"""
+    try:
+        result = subprocess.run(
+            ["git", "-C", root, "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            capture_output=True,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    names = result.stdout.decode("utf-8", "surrogateescape").split("\0")
+    return [os.path.join(root, name) for name in names if name]
+
+
+def _read_gitignore(directory):
+    try:
+        with open(os.path.join(directory, ".gitignore"), 'r') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    return [line.strip() for line in lines
+            if line.strip() and not line.startswith("#") and not line.startswith("!")]
+
+
+def _ignored(rel_path, is_dir, rules):
+    for base, pattern in rules:
+        if base and not rel_path.startswith(base + "/"):
+            continue
+        path = rel_path[len(base) + 1:] if base else rel_path
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip("/")
+        if pattern.startswith("/") or "/" in pattern:
+            if fnmatch.fnmatch(path, pattern.lstrip("/")):
+                return True
+        elif fnmatch.fnmatch(os.path.basename(path), pattern):
+            return True
+    return False
+
+
+def _walk_with_gitignore(root):
+    """Fallback walker applying .gitignore patterns (no negation support)"""
+    rules = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir
+        rules.extend((rel_dir, pattern) for pattern in _read_gitignore(dirpath))
+
+        def rel(name):
+            return f"{rel_dir}/{name}" if rel_dir else name
+
+        dirnames[:] = sorted(d for d in dirnames
+                             if d != ".git" and not _ignored(rel(d), True, rules))
+        for name in sorted(filenames):
+            if not _ignored(rel(name), False, rules):
+                yield os.path.join(dirpath, name)
+
+
+def walk_source_files(root, max_bytes=DEFAULT_MAX_BYTES):
+    """Yield reviewable files under root, honouring .gitignore
+
+    Binary files, empty files and files over max_bytes are skipped.
+    """
+    paths = _git_listed_files(root)
+    if paths is None:
+        paths = _walk_with_gitignore(root)
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if size == 0 or size > max_bytes or is_binary(path):
+            continue
+        yield path
+
+
+def pack_files(files, token_budget=PACK_TOKEN_BUDGET, max_files=None, estimate=raw_estimate):
+    """First-fit-decreasing bin packing of (path, content) pairs
+
+    Returns a list of batches, each a list of (path, content) whose
+    estimated tokens fit the budget. If given, max_files(tokens_per_file)
+    caps how many files a batch may hold at its mean file size (so the
+    combined review fits one response). A file larger than the budget
+    gets a batch of its own.
+    """
+    sized = sorted(((estimate(content), path, content) for path, content in files),
+                   key=lambda f: f[0], reverse=True)
+    bins = []
+    for tokens, path, content in sized:
+        for batch in bins:
+            count = len(batch["files"]) + 1
+            total = batch["tokens"] + tokens
+            if total > token_budget:
+                continue
+            if max_files is not None and count > max_files(total // count):
+                continue
+            batch["files"].append((path, content))
+            batch["tokens"] = total
+            break
+        else:
+            bins.append({"files": [(path, content)], "tokens": tokens})
+    return [batch["files"] for batch in bins]
+
+
+def build_packed_prompt(batch):
+    """Format several files into one review prompt with per-file delimiters"""
+    sections = []
+    for path, content in batch:
+        sections.append(f"<<<FILE {path}>>>\n{content}\n<<<END FILE {path}>>>")
+
+    headings = "\n".join(f"### FILE: {path}" for path, _ in batch)
+    return f"""Review each of the following {len(batch)} code files. For every file provide:
+1. Summary of functionality
+2. Code quality assessment (1-10)
+3. Potential issues or bugs
+4. Improvement suggestions
+5. Security considerations
+
+Start each file's review with its heading line exactly as listed below,
+in this order, and write nothing before the first heading:
+{headings}
+
+{chr(10).join(sections)}
+"""
+
+
+def split_packed_response(text, paths):
+    """Split a packed review into {path: review}, or None if it doesn't match"""
+    matches = list(_SECTION_RE.finditer(text))
+    found = [m.group(1) for m in matches]
+    if sorted(found) != sorted(paths):
+        return None
+
+    reviews = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        review = text[match.end():end].strip()
+        if not review:
+            return None
+        reviews[match.group(1)] = review
+    return reviews
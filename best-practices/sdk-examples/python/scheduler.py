@@ -0,0 +1,395 @@
+"""
+Priority Lanes Scheduler
+Sits in front of the Messages client so interactive queries don't queue
+behind bulk work. Each lane has a weight, a concurrency cap and an
+optional preempt flag:
+
+- lanes flagged preempt are dispatched before any queued work of other lanes
+- otherwise lanes share slots by weighted fair queuing
+- `reserved` slots are only ever given to preempting lanes, since a
+  request already in flight cannot be preempted
+
+SharedLaneScheduler keeps its queue in SQLite so every process and
+thread using the same database (bulk worker processes, interactive CLI
+calls) competes for one set of slots.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from jobqueue import owner_alive, worker_name
+from tracing import span
+
+MAX_CONCURRENCY = 8
+# Slots kept free for preempting (interactive) lanes
+RESERVED_SLOTS = 2
+# Wait times kept per lane for percentile metrics
+WAIT_SAMPLES = 1000
+# A granted slot is reclaimed if its lease isn't renewed for this long;
+# holders renew it every third of that, however long their stream runs
+SLOT_LEASE_SECONDS = 120
+# Waiting tickets not refreshed for this long belong to a dead process
+WAITER_TIMEOUT_SECONDS = 30
+# How often a waiting process checks whether its ticket was granted
+POLL_SECONDS = {"interactive": 0.005}
+DEFAULT_POLL_SECONDS = 0.05
+# How often a waiting process refreshes its ticket and reclaims stale slots
+MAINTENANCE_SECONDS = 1.0
+
+
+@dataclass
+class Lane:
+    name: str
+    weight: float
+    max_concurrency: int
+    preempt: bool = False
+    # Statistics of this process's requests
+    dispatched: int = 0
+    max_depth: int = 0
+    waits: deque = field(default_factory=lambda: deque(maxlen=WAIT_SAMPLES))
+
+
+DEFAULT_LANES = [
+    Lane("interactive", weight=8, max_concurrency=MAX_CONCURRENCY, preempt=True),
+    Lane("bulk", weight=3, max_concurrency=MAX_CONCURRENCY),
+    Lane("background", weight=1, max_concurrency=2),
+]
+
+
+def choose_lane(lanes, heads, running, total_running, shared_running,
+                max_concurrency, reserved):
+    """Name of the lane whose queued request starts next, or None
+
+    `heads` maps lanes with queued requests to the virtual finish time
+    of their first request; `running` maps lanes to slots in use.
+    """
+    if total_running >= max_concurrency:
+        return None
+    shared_full = shared_running >= max_concurrency - reserved
+    eligible = [lane for name, lane in lanes.items()
+                if name in heads and running.get(name, 0) < lane.max_concurrency
+                and (lane.preempt or not shared_full)]
+    if not eligible:
+        return None
+    preempting = [lane for lane in eligible if lane.preempt]
+    return min(preempting or eligible, key=lambda lane: heads[lane.name]).name
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class SharedLaneScheduler:
+    """Lane scheduler whose queue lives in SQLite, shared by all processes
+
+    Each request inserts a ticket row into api_slots. Whoever changes
+    the table (enqueue, release, periodic maintenance) grants free slots
+    to waiting tickets by choose_lane(), inside one BEGIN IMMEDIATE
+    transaction; waiters poll their own row.
+    """
+
+    def __init__(self, db_path, lanes=None, max_concurrency=MAX_CONCURRENCY,
+                 reserved=RESERVED_SLOTS):
+        lanes = lanes if lanes is not None else DEFAULT_LANES
+        self.db_path = os.path.expanduser(db_path)
+        self.lanes = {lane.name: Lane(lane.name, lane.weight, lane.max_concurrency, lane.preempt)
+                      for lane in lanes}
+        self.max_concurrency = max_concurrency
+        self.reserved = reserved
+        self.owner = worker_name()
+        self._waits_lock = threading.Lock()
+        self.init_database()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def init_database(self):
+        """Create the api_slots and api_lane_state tables"""
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_slots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lane TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                finish REAL NOT NULL,
+                enqueued REAL NOT NULL,
+                heartbeat REAL NOT NULL,
+                granted_at REAL,
+                lease_expires REAL
+            )
+        ''')
+        # Per-lane last virtual finish time; the '*' row is the global virtual time
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_lane_state (
+                lane TEXT PRIMARY KEY,
+                last_finish REAL NOT NULL
+            )
+        ''')
+        conn.close()
+
+    def _transaction(self, body):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = body(conn, time.time())
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _state(conn, key):
+        row = conn.execute("SELECT last_finish FROM api_lane_state WHERE lane = ?", (key,)).fetchone()
+        return row[0] if row else 0.0
+
+    @staticmethod
+    def _set_state(conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO api_lane_state (lane, last_finish) VALUES (?, ?)",
+                     (key, value))
+
+    def _reclaim(self, conn, now):
+        """Drop tickets of processes that died or overran their lease"""
+        conn.execute('''
+            DELETE FROM api_slots
+            WHERE (granted_at IS NULL AND heartbeat < ?)
+               OR (granted_at IS NOT NULL AND lease_expires < ?)
+        ''', (now - WAITER_TIMEOUT_SECONDS, now))
+        for (owner,) in conn.execute("SELECT DISTINCT owner FROM api_slots").fetchall():
+            if not owner_alive(owner):
+                conn.execute("DELETE FROM api_slots WHERE owner = ?", (owner,))
+
+    def _dispatch(self, conn, now):
+        """Grant free slots to waiting tickets of any process"""
+        running = dict(conn.execute('''
+            SELECT lane, COUNT(*) FROM api_slots
+            WHERE granted_at IS NOT NULL GROUP BY lane
+        ''').fetchall())
+        queues = {}
+        for ticket_id, lane, finish in conn.execute('''
+            SELECT id, lane, finish FROM api_slots
+            WHERE granted_at IS NULL ORDER BY finish, id
+        '''):
+            if lane in self.lanes:
+                queues.setdefault(lane, deque()).append((ticket_id, finish))
+
+        virtual_time = self._state(conn, "*")
+        while True:
+            total = sum(running.values())
+            shared = sum(count for name, count in running.items()
+                         if name in self.lanes and not self.lanes[name].preempt)
+            name = choose_lane(self.lanes, {lane: q[0][1] for lane, q in queues.items() if q},
+                               running, total, shared, self.max_concurrency, self.reserved)
+            if name is None:
+                break
+            ticket_id, finish = queues[name].popleft()
+            conn.execute('''
+                UPDATE api_slots SET granted_at = ?, lease_expires = ?
+                WHERE id = ?
+            ''', (now, now + SLOT_LEASE_SECONDS, ticket_id))
+            running[name] = running.get(name, 0) + 1
+            virtual_time = max(virtual_time, finish - 1 / self.lanes[name].weight)
+        self._set_state(conn, "*", virtual_time)
+
+    def acquire(self, lane_name):
+        """Block until the lane is granted a slot; returns the ticket id"""
+        lane = self.lanes[lane_name]
+
+        def enqueue(conn, now):
+            self._reclaim(conn, now)
+            finish = max(self._state(conn, lane_name), self._state(conn, "*")) + 1 / lane.weight
+            self._set_state(conn, lane_name, finish)
+            ticket_id = conn.execute('''
+                INSERT INTO api_slots (lane, owner, finish, enqueued, heartbeat)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (lane_name, self.owner, finish, now, now)).lastrowid
+            self._dispatch(conn, now)
+            depth = conn.execute('''
+                SELECT COUNT(*) FROM api_slots WHERE lane = ? AND granted_at IS NULL
+            ''', (lane_name,)).fetchone()[0]
+            return ticket_id, depth
+
+        def maintain(conn, now):
+            conn.execute("UPDATE api_slots SET heartbeat = ? WHERE id = ?", (now, ticket_id))
+            self._reclaim(conn, now)
+            self._dispatch(conn, now)
+
+        started = time.monotonic()
+        ticket_id, depth = self._transaction(enqueue)
+        with self._waits_lock:
+            lane.max_depth = max(lane.max_depth, depth)
+        poll = POLL_SECONDS.get(lane_name, DEFAULT_POLL_SECONDS)
+        next_maintenance = started + MAINTENANCE_SECONDS
+        conn = self.connect()
+        try:
+            while True:
+                row = conn.execute("SELECT granted_at FROM api_slots WHERE id = ?",
+                                   (ticket_id,)).fetchone()
+                if row is None:
+                    raise RuntimeError(f"Scheduler ticket {ticket_id} was reclaimed while waiting")
+                if row[0] is not None:
+                    break
+                if time.monotonic() >= next_maintenance:
+                    self._transaction(maintain)
+                    next_maintenance = time.monotonic() + MAINTENANCE_SECONDS
+                    continue
+                time.sleep(poll)
+        except BaseException:
+            conn.close()
+            self.release(lane_name, ticket_id)
+            raise
+        conn.close()
+
+        with self._waits_lock:
+            lane.dispatched += 1
+            lane.waits.append(time.monotonic() - started)
+        return ticket_id
+
+    def extend(self, ticket):
+        """Push a granted slot's lease forward; returns False if it was reclaimed"""
+        conn = self.connect()
+        try:
+            cursor = conn.execute('''
+                UPDATE api_slots SET lease_expires = ?
+                WHERE id = ? AND granted_at IS NOT NULL
+            ''', (time.time() + SLOT_LEASE_SECONDS, ticket))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release(self, lane_name, ticket=None):
+        """Free the slot (or withdraw the waiting ticket) and hand out free slots"""
+        def remove(conn, now):
+            conn.execute("DELETE FROM api_slots WHERE id = ?", (ticket,))
+            self._dispatch(conn, now)
+        self._transaction(remove)
+
+    def slot(self, lane_name):
+        """Context manager holding one slot of a lane"""
+        return _Slot(self, lane_name)
+
+    def metrics(self):
+        """Queue depth and running slots across all processes; deepest
+        queue seen and wait-time percentiles (ms) for this process's requests"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT lane, SUM(granted_at IS NULL), SUM(granted_at IS NOT NULL)
+            FROM api_slots GROUP BY lane
+        ''').fetchall()
+        conn.close()
+        counts = {lane: (queued, running) for lane, queued, running in rows}
+        with self._waits_lock:
+            return {
+                name: {
+                    "queued": counts.get(name, (0, 0))[0],
+                    "max_queued": lane.max_depth,
+                    "running": counts.get(name, (0, 0))[1],
+                    "dispatched": lane.dispatched,
+                    "wait_p50_ms": round(_percentile(lane.waits, 50) * 1000, 1),
+                    "wait_p95_ms": round(_percentile(lane.waits, 95) * 1000, 1),
+                }
+                for name, lane in self.lanes.items()
+            }
+
+    def client(self, client, lane_name):
+        """A view of an Anthropic client whose Messages calls go through a lane"""
+        return ScheduledClient(client, self, lane_name)
+
+
+class _SlotKeeper:
+    """Renews a held slot's lease in the background, like jobqueue.LeaseKeeper"""
+
+    def __init__(self, scheduler, ticket):
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(SLOT_LEASE_SECONDS / 3):
+            try:
+                if not self.scheduler.extend(self.ticket):
+                    return
+            except sqlite3.OperationalError:
+                # Database busy; a third of the lease is left, so try again next tick
+                continue
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class _Slot:
+    def __init__(self, scheduler, lane_name):
+        self.scheduler = scheduler
+        self.lane_name = lane_name
+
+    def __enter__(self):
+        with span("scheduler.wait", lane=self.lane_name):
+            self.ticket = self.scheduler.acquire(self.lane_name)
+        self.keeper = _SlotKeeper(self.scheduler, self.ticket)
+        self.keeper.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.keeper.stop()
+        self.scheduler.release(self.lane_name, self.ticket)
+        return False
+
+
+class _ScheduledStream:
+    """messages.stream() context that holds a lane slot while streaming"""
+
+    def __init__(self, messages, slot, request):
+        self.messages = messages
+        self.slot = slot
+        self.request = request
+        self.stream = None
+
+    def __enter__(self):
+        self.slot.__enter__()
+        try:
+            self.stream = self.messages.stream(**self.request)
+            return self.stream.__enter__()
+        except BaseException:
+            self.slot.__exit__(None, None, None)
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self.stream.__exit__(exc_type, exc, tb)
+        finally:
+            self.slot.__exit__(exc_type, exc, tb)
+
+
+class _ScheduledMessages:
+    def __init__(self, messages, scheduler, lane_name):
+        self._messages = messages
+        self._scheduler = scheduler
+        self._lane_name = lane_name
+
+    def create(self, **request):
+        with self._scheduler.slot(self._lane_name):
+            return self._messages.create(**request)
+
+    def stream(self, **request):
+        return _ScheduledStream(self._messages, self._scheduler.slot(self._lane_name), request)
+
+
+class ScheduledClient:
+    def __init__(self, client, scheduler, lane_name):
+        self.messages = _ScheduledMessages(client.messages, scheduler, lane_name)
+
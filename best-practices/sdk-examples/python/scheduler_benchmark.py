@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Priority Lanes Benchmark - No API Calls Required
+Floods a SharedLaneScheduler with bulk requests from several processes
+while another process issues interactive requests, then reports the
+interactive and bulk wait times and the bulk throughput. API calls are
+simulated with sleeps.
+
+Runs twice: with the default lanes, and with a baseline where every lane
+has the same weight, no preemption and no reserved slots.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from scheduler import DEFAULT_LANES, Lane, MAX_CONCURRENCY, SharedLaneScheduler
+
+BASELINE_LANES = [
+    Lane("interactive", weight=1, max_concurrency=MAX_CONCURRENCY),
+    Lane("bulk", weight=1, max_concurrency=MAX_CONCURRENCY),
+    Lane("background", weight=1, max_concurrency=MAX_CONCURRENCY),
+]
+
+
+def make_scheduler(db_path, config):
+    if config == "baseline":
+        return SharedLaneScheduler(db_path, BASELINE_LANES, reserved=0)
+    return SharedLaneScheduler(db_path, DEFAULT_LANES)
+
+
+def bulk_process(db_path, config, threads, latency, stop_at, results):
+    """One bulk worker process: `threads` callers issuing back-to-back requests"""
+    scheduler = make_scheduler(db_path, config)
+    done = []
+
+    def caller():
+        count = 0
+        while time.time() < stop_at:
+            with scheduler.slot("bulk"):
+                time.sleep(latency)
+            count += 1
+        done.append(count)
+
+    workers = [threading.Thread(target=caller) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(("bulk", sum(done), list(scheduler.lanes["bulk"].waits)))
+
+
+def interactive_process(db_path, config, interval, latency, start_at, stop_at, results):
+    """Issues one interactive request every `interval` seconds"""
+    scheduler = make_scheduler(db_path, config)
+    time.sleep(max(0, start_at - time.time()))
+    while time.time() < stop_at:
+        threading.Thread(target=lambda: _interactive_call(scheduler, latency)).start()
+        time.sleep(interval)
+    time.sleep(latency * 4)
+    results.put(("interactive", 0, list(scheduler.lanes["interactive"].waits)))
+
+
+def _interactive_call(scheduler, latency):
+    with scheduler.slot("interactive"):
+        time.sleep(latency)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(config, args):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    make_scheduler(db_path, config)
+    results = multiprocessing.Queue()
+    start = time.time()
+    stop_at = start + args.seconds
+    processes = [
+        multiprocessing.Process(
+            target=bulk_process,
+            args=(db_path, config, args.bulk_threads, args.latency, stop_at, results))
+        for _ in range(args.bulk_processes)
+    ]
+    processes.append(multiprocessing.Process(
+        target=interactive_process,
+        args=(db_path, config, args.interval, args.latency, start + 1, stop_at, results)))
+    for process in processes:
+        process.start()
+
+    bulk_count, waits = 0, {"bulk": [], "interactive": []}
+    for _ in processes:
+        lane, count, lane_waits = results.get()
+        bulk_count += count
+        waits[lane].extend(lane_waits)
+    for process in processes:
+        process.join()
+
+    print(f"{config}:")
+    for lane in ("interactive", "bulk"):
+        values = waits[lane]
+        print(f"  {lane:<12} n={len(values):<5} "
+              f"wait p50={percentile(values, 50) * 1000:7.1f} ms  "
+              f"p95={percentile(values, 95) * 1000:7.1f} ms")
+    print(f"  bulk throughput: {bulk_count / args.seconds:.1f} requests/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared priority-lane scheduler")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--bulk-processes", type=int, default=4)
+    parser.add_argument("--bulk-threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated API call time (s)")
+    parser.add_argument("--interval", type=float, default=0.25, help="time between interactive calls (s)")
+    args = parser.parse_args()
+
+    print(f"{args.bulk_processes} bulk processes x {args.bulk_threads} threads, "
+          f"{args.latency * 1000:.0f} ms simulated calls, "
+          f"{MAX_CONCURRENCY} slots\n")
+    for config in ("baseline", "lanes"):
+        run(config, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Single-Flight Request Coalescing
+Concurrent callers issuing an identical request share one API call:
+the first caller (the leader) makes the request and every other caller
+waits for, and receives, the same result.
+"""
+import hashlib
+import json
+import threading
+
+
+def request_key(params):
+    """Canonical hash of a Messages API request"""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """An in-flight call awaited by one or more callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _StreamCall:
+    """An in-flight streaming call whose chunks are replayed to every waiter"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        # Callers other than the leader currently reading the stream
+        self.followers = 0
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def follow(self):
+        """Yield every chunk from the start, blocking until more arrive"""
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.finished:
+                    self.cond.wait()
+                if i < len(self.chunks):
+                    chunk = self.chunks[i]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            i += 1
+            yield chunk
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share the same key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Call fn() unless an identical call is in flight; return its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key, fn):
+        """Iterate fn()'s chunks, sharing one underlying stream per key
+
+        The key is only registered once the returned iterator is first
+        advanced, and the leader's iterator drives the request. Waiters
+        receive every chunk, including those sent before they joined.
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall()
+                self._streams[key] = call
+                self.executed += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                yield from call.follow()
+            finally:
+                with self._lock:
+                    call.followers -= 1
+            return
+
+        try:
+            chunks = iter(fn())
+            for chunk in chunks:
+                call.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The leader stopped reading early. With nobody else reading,
+            # close the request (freeing its scheduler slot) rather than pay
+            # for the rest; otherwise finish it for the waiters in the
+            # background instead of blocking the leader
+            with self._lock:
+                followed = call.followers > 0
+                if not followed:
+                    del self._streams[key]
+            if followed:
+                threading.Thread(target=self._drain, args=(key, call, chunks), daemon=True).start()
+            else:
+                close = getattr(chunks, "close", None)
+                try:
+                    if close is not None:
+                        close()
+                finally:
+                    call.finish()
+            raise
+        except BaseException as e:
+            call.error = e
+            self._finish(key, call)
+            raise
+        self._finish(key, call)
+
+    def _drain(self, key, call, chunks):
+        try:
+            for chunk in chunks:
+                call.append(chunk)
+        except Exception as e:
+            call.error = e
+        self._finish(key, call)
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._streams[key]
+        call.finish()
+
+
+class _CoalescingMessages:
+    def __init__(self, messages, flights):
+        self._messages = messages
+        self._flights = flights
+
+    def create(self, **request):
+        return self._flights.do(request_key(request), lambda: self._messages.create(**request))
+
+
+class CoalescingClient:
+    """A view of an Anthropic client whose messages.create calls are coalesced"""
+
+    def __init__(self, client, flights):
+        self.messages = _CoalescingMessages(client.messages, flights)
@@ -5,6 +5,7 @@ Shows how to use Claude's streaming API for real-time responses
 """
 import os
 from anthropic import Anthropic
+import tokens
 
 def main():
     client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
@@ -12,15 +13,23 @@ def main():
     print("Asking Claude to write a story (streaming)...")
     print("-" * 50)
     
-    with client.messages.stream(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=500,
-        messages=[
+    request = {
+        "model": "claude-3-5-sonnet-20241022",
+        "messages": [
             {"role": "user", "content": "Write a short story about a robot learning to paint"}
         ]
-    ) as stream:
+    }
+    # Size max_tokens from the expected length of the answer
+    estimator = tokens.default_estimator
+    plan = estimator.plan(request, "story", streaming=True)
+    request.update(model=plan.model, max_tokens=plan.max_tokens)
+    
+    with client.messages.stream(**request) as stream:
         for text in stream.text_stream:
             print(text, end='', flush=True)
+        final = stream.get_final_message()
+    estimator.record(request, plan, final.usage, "story",
+                     truncated=final.stop_reason == "max_tokens")
     
     print("\n" + "-" * 50)
     print("Stream complete\!")
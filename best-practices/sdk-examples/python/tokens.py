@@ -0,0 +1,290 @@
+"""
+Local Token Estimation and Request Sizing
+Estimates prompt size offline, calibrates the estimate against the
+`usage` numbers of real responses, and picks max_tokens (and, if needed,
+a model with a larger output limit) before a request is sent.
+"""
+import math
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+# (context window, maximum output tokens)
+MODEL_LIMITS = {
+    "claude-sonnet-4-20250514": (200_000, 64_000),
+    "claude-3-5-sonnet-20241022": (200_000, 8_192),
+    "claude-3-haiku-20240307": (200_000, 4_096),
+}
+DEFAULT_LIMITS = (200_000, 4_096)
+# Model to switch to when a request needs more output than its model allows
+LARGER_OUTPUT_MODEL = "claude-sonnet-4-20250514"
+
+# Typical response length per task before any usage has been observed
+EXPECTED_OUTPUT = {
+    "file_review": 1200,
+    "packed_review": 600,
+    "query": 700,
+    "repo_analysis": 1200,
+    "pr_description": 700,
+    "daily_summary": 350,
+    "code_analysis": 1000,
+    "story": 250,
+}
+DEFAULT_EXPECTED_OUTPUT = 700
+# max_tokens = expected output * headroom, so long answers aren't cut off
+OUTPUT_HEADROOM = 2.0
+MIN_MAX_TOKENS = 256
+# The SDK rejects non-streaming requests whose max_tokens implies more than
+# ten minutes of generation (about 21,333 tokens); stay well below that
+NON_STREAMING_MAX_TOKENS = 16_384
+# Output averages are kept per input-size class (upper bounds, in tokens),
+# so short reviews of tiny files don't shrink max_tokens for large ones
+INPUT_SIZE_CLASSES = (1_024, 4_096, 16_384)
+# Class of prompts at or above the last bound
+LARGEST_SIZE_CLASS = len(INPUT_SIZE_CLASSES)
+# Per-message framing the API adds on top of the text itself
+MESSAGE_OVERHEAD_TOKENS = 8
+# Weight of each new observation in the running averages
+SMOOTHING = 0.2
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d+|\s+|[^\sA-Za-z\d]")
+
+
+class PromptTooLargeError(ValueError):
+    """The prompt cannot fit the model's context window"""
+
+
+def raw_estimate(text):
+    """Uncalibrated token count: words split into ~4-letter pieces, digits
+    into ~3-digit pieces, each symbol and whitespace run counted once"""
+    count = 0
+    for piece in _PIECE_RE.findall(text):
+        first = piece[0]
+        if first.isalpha():
+            count += math.ceil(len(piece) / 4)
+        elif first.isdigit():
+            count += math.ceil(len(piece) / 3)
+        elif first.isspace():
+            count += 1 if len(piece) < 4 else math.ceil(len(piece) / 4)
+        else:
+            count += 1
+    return count
+
+
+def request_text(request):
+    """All text of a Messages API request that counts as input"""
+    parts = []
+    system = request.get("system")
+    if isinstance(system, str):
+        parts.append(system)
+    for message in request.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content)
+    return parts
+
+
+def raw_request_estimate(request):
+    """Uncalibrated input tokens of a whole Messages API request"""
+    raw = sum(raw_estimate(part) for part in request_text(request))
+    return raw + MESSAGE_OVERHEAD_TOKENS * len(request.get("messages", []))
+
+
+def size_class(input_tokens):
+    """Index of the input-size class a prompt falls into"""
+    for i, bound in enumerate(INPUT_SIZE_CLASSES):
+        if input_tokens < bound:
+            return i
+    return LARGEST_SIZE_CLASS
+
+
+def _split_line(line, max_tokens):
+    """Cut a single overlong line into pieces of at most ~max_tokens"""
+    tokens = raw_estimate(line)
+    if tokens <= max_tokens:
+        return [line]
+    step = max(1, int(len(line) * max_tokens / tokens))
+    return [line[i:i + step] for i in range(0, len(line), step)]
+
+
+def split_text(text, max_tokens):
+    """Split text into chunks of at most ~max_tokens (uncalibrated)
+
+    Chunks end on line boundaries; a line longer than max_tokens on its
+    own is cut into several pieces.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        for piece in _split_line(line, max_tokens):
+            tokens = raw_estimate(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+@dataclass
+class RequestPlan:
+    model: str
+    input_tokens: int
+    # Input tokens per unit; picks the size class of the output average
+    unit_tokens: int
+    max_tokens: int
+    output_cap: int
+
+
+class TokenEstimator:
+    """Calibrated token estimates, optionally persisted to SQLite"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # name -> (value, samples)
+        self._stats = {}
+        if db_path:
+            self.init_database()
+
+    def init_database(self):
+        """Create the token_stats table and load earlier calibration"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS token_stats (
+                name TEXT PRIMARY KEY,
+                value REAL,
+                samples INTEGER
+            )
+        ''')
+        conn.commit()
+        cursor.execute("SELECT name, value, samples FROM token_stats")
+        self._stats = {name: (value, samples) for name, value, samples in cursor.fetchall()}
+        conn.close()
+
+    def _get(self, name, default):
+        return self._stats.get(name, (default, 0))[0]
+
+    def _observe(self, name, observed, default):
+        with self._lock:
+            value, samples = self._stats.get(name, (default, 0))
+            # Mean of the default and the first few samples, then a moving average
+            weight = max(SMOOTHING, 1 / (samples + 2))
+            value += weight * (observed - value)
+            self._stats[name] = (value, samples + 1)
+        if self.db_path:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('''
+                INSERT OR REPLACE INTO token_stats (name, value, samples)
+                VALUES (?, ?, ?)
+            ''', (name, value, samples + 1))
+            conn.commit()
+            conn.close()
+
+    def estimate(self, text, model=None):
+        """Calibrated token estimate for a piece of text"""
+        return math.ceil(raw_estimate(text) * self._get(f"input_ratio:{model}", 1.0))
+
+    def split(self, text, max_tokens, model=None):
+        """split_text with max_tokens given in calibrated tokens"""
+        raw_budget = max(1, int(max_tokens / self._get(f"input_ratio:{model}", 1.0)))
+        return split_text(text, raw_budget)
+
+    def estimate_request(self, request):
+        """Calibrated input tokens of a whole Messages API request"""
+        raw = raw_request_estimate(request)
+        return math.ceil(raw * self._get(f"input_ratio:{request.get('model')}", 1.0))
+
+    def class_output(self, task, input_class):
+        """Running average of output tokens for a task in one input-size class"""
+        default = EXPECTED_OUTPUT.get(task, DEFAULT_EXPECTED_OUTPUT)
+        return self._get(f"output:{task}:{input_class}", default)
+
+    def expected_output(self, task, input_tokens=0):
+        """Running average of output tokens for a task at this input size"""
+        return self.class_output(task, size_class(input_tokens))
+
+    def input_budget(self, model, task):
+        """Largest prompt (in estimated tokens) that leaves room for the answer"""
+        context_window, max_output = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+        # A prompt this close to the budget falls in the largest class
+        expected = self.class_output(task, LARGEST_SIZE_CLASS)
+        reserved = min(max_output, NON_STREAMING_MAX_TOKENS,
+                       math.ceil(expected * OUTPUT_HEADROOM))
+        return context_window - reserved
+
+    def max_units(self, task, input_tokens_per_unit=0):
+        """How many units (e.g. packed files) one non-streaming request can answer"""
+        per_unit = self.expected_output(task, input_tokens_per_unit) * OUTPUT_HEADROOM
+        return max(1, int(NON_STREAMING_MAX_TOKENS // per_unit))
+
+    def plan(self, request, task, units=1, streaming=False, unit_tokens=None):
+        """Choose model and max_tokens for a request before sending it
+
+        `units` scales the expected output, e.g. the number of files
+        reviewed in one packed request, and `unit_tokens` is the input
+        size of one unit (by default the whole request split evenly).
+        Non-streaming requests are capped at NON_STREAMING_MAX_TOKENS.
+        """
+        model = request["model"]
+        input_tokens = self.estimate_request(request)
+        if unit_tokens is None:
+            unit_tokens = input_tokens // units
+        expected = self.expected_output(task, unit_tokens) * units
+        wanted = max(MIN_MAX_TOKENS, math.ceil(expected * OUTPUT_HEADROOM))
+
+        context_window, max_output = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+        if wanted > max_output and model != LARGER_OUTPUT_MODEL:
+            model = LARGER_OUTPUT_MODEL
+            context_window, max_output = MODEL_LIMITS[model]
+
+        output_cap = min(max_output, context_window - input_tokens)
+        if not streaming:
+            output_cap = min(output_cap, NON_STREAMING_MAX_TOKENS)
+        if output_cap < MIN_MAX_TOKENS:
+            raise PromptTooLargeError(
+                f"Prompt of ~{input_tokens} tokens does not fit {model} "
+                f"({context_window} token context)")
+        return RequestPlan(model, input_tokens, unit_tokens, min(wanted, output_cap), output_cap)
+
+    def record(self, request, plan, usage, task, units=1, truncated=False):
+        """Calibrate against the usage reported for a completed request
+
+        A truncated response only says the answer was longer than
+        max_tokens, so it is not used as an output sample.
+        """
+        raw = raw_request_estimate(request)
+        if raw and usage.input_tokens:
+            self._observe(f"input_ratio:{plan.model}", usage.input_tokens / raw, 1.0)
+        if truncated:
+            return
+        # Same class plan() read from, so both use one running average
+        self._observe(f"output:{task}:{size_class(plan.unit_tokens)}", usage.output_tokens / units,
+                      EXPECTED_OUTPUT.get(task, DEFAULT_EXPECTED_OUTPUT))
+
+
+default_estimator = TokenEstimator()
+
+
+def create_sized_message(client, task, estimator=None, units=1, unit_tokens=None, **request):
+    """messages.create with max_tokens chosen by the estimator
+
+    A response cut off at max_tokens is retried once with a doubled
+    limit (bounded by what the model and context allow).
+    """
+    estimator = estimator or default_estimator
+    plan = estimator.plan(request, task, units, unit_tokens=unit_tokens)
+    request = dict(request, model=plan.model, max_tokens=plan.max_tokens)
+
+    message = client.messages.create(**request)
+    if message.stop_reason == "max_tokens" and plan.max_tokens < plan.output_cap:
+        request["max_tokens"] = min(plan.output_cap, plan.max_tokens * 2)
+        message = client.messages.create(**request)
+    estimator.record(request, plan, message.usage, task, units,
+                     truncated=message.stop_reason == "max_tokens")
+    return message
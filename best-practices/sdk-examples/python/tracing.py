@@ -0,0 +1,220 @@
+"""
+Lightweight Span Tracing
+Records nested timing spans and writes Chrome trace-event JSON
+(open the file in https://ui.perfetto.dev or chrome://tracing)
+
+Enable with CLAUDE_TRACE=/path/to/trace.json or the --trace flag.
+When disabled, span() returns a shared no-op object, so instrumented
+code pays roughly one attribute lookup per span.
+"""
+import argparse
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+_lock = threading.Lock()
+_events = []
+_trace_path = None
+
+
+class _NoopSpan:
+    """Span returned while tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    """A single complete ("X") trace event"""
+
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if self.args:
+            event["args"] = self.args
+        with _lock:
+            _events.append(event)
+        return False
+
+    def set(self, **args):
+        """Attach extra arguments (e.g. token counts) after the span started"""
+        self.args.update(args)
+
+
+def enabled():
+    """Return True when spans are being recorded"""
+    return _trace_path is not None
+
+
+def trace_path():
+    """Path spans are written to, or None while tracing is disabled"""
+    return _trace_path
+
+
+def worker_trace_path(path, worker):
+    """Trace file for a worker process, next to the parent's trace file"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{worker}{ext or '.json'}"
+
+
+def enable(path):
+    """Start recording spans; they are written to `path` at exit"""
+    global _trace_path
+    if _trace_path is None:
+        atexit.register(flush)
+    _trace_path = os.path.expanduser(path)
+
+
+def span(name, **args):
+    """Context manager timing the enclosed block as a named span"""
+    if _trace_path is None:
+        return _NOOP
+    return _Span(name, args)
+
+
+def traced(name=None):
+    """Decorator wrapping every call of a function in a span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return func(*args, **kwargs)
+            with _Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush():
+    """Write all recorded spans to the trace file"""
+    if _trace_path is None:
+        return
+    with _lock:
+        events = list(_events)
+    metadata = [{
+        "name": "process_name",
+        "ph": "M",
+        "pid": os.getpid(),
+        "args": {"name": os.path.basename(sys.argv[0]) or "python"},
+    }]
+    with open(_trace_path, 'w') as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def profile(mode, output=None):
+    """Capture a cProfile ("cpu") or tracemalloc ("mem") profile of the block"""
+    if not mode:
+        yield
+        return
+
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(os.path.expanduser(output))
+                print(f"CPU profile written to {output}")
+            else:
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    elif mode == "mem":
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            if output:
+                snapshot.dump(os.path.expanduser(output))
+                print(f"Memory snapshot written to {output}")
+            else:
+                print("Top memory allocations:")
+                for stat in snapshot.statistics("lineno")[:25]:
+                    print(f"  {stat}")
+    else:
+        raise ValueError(f"Unknown profile mode: {mode!r} (expected 'cpu' or 'mem')")
+
+
+def add_arguments(parser):
+    """Register --trace / --profile options on an argparse parser"""
+    parser.add_argument(
+        "--trace", metavar="PATH", default=os.environ.get("CLAUDE_TRACE"),
+        help="write Chrome trace-event JSON to PATH (env: CLAUDE_TRACE)")
+    parser.add_argument(
+        "--profile", choices=["cpu", "mem"], default=os.environ.get("CLAUDE_PROFILE"),
+        help="profile the command with cProfile or tracemalloc (env: CLAUDE_PROFILE)")
+    parser.add_argument(
+        "--profile-output", metavar="PATH", default=os.environ.get("CLAUDE_PROFILE_OUTPUT"),
+        help="save the raw profile instead of printing a report")
+    return parser
+
+
+def configure(args):
+    """Apply parsed --trace options"""
+    if args.trace:
+        enable(args.trace)
+
+
+def parse_args(description=None, argv=None):
+    """Parse the standard tracing flags for scripts without their own CLI"""
+    parser = add_arguments(argparse.ArgumentParser(description=description))
+    args = parser.parse_args(argv)
+    configure(args)
+    return args
+
+
+def _reset_after_fork():
+    # A forked worker starts with a copy of the parent's buffer; drop it
+    # so each process only writes its own spans
+    global _lock
+    _lock = threading.Lock()
+    _events.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+if os.environ.get("CLAUDE_TRACE"):
+    enable(os.environ["CLAUDE_TRACE"])